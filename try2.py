@@ -1,14 +1,33 @@
-#%%import mesa
-import random
+#%%
+import mesa
+import multiprocessing as mp
 import numpy as np
 import pandas as pd
 
+try:
+    from numba import njit, prange
+    HAVE_NUMBA = True
+except ImportError:
+    # numba is optional: without it the kernels below run as plain Python
+    HAVE_NUMBA = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+# Debug output from inside the model (intentions, market sales). Off by
+# default so the step loop does no string formatting or I/O.
+VERBOSE = False
+
 # --- GLOBAL CONSTANTS (From Report Section 3.1 & 3.5) ---
 
 # Financial Constants
 COST_PER_LABEL_UPGRADE = 5000  # Cost to jump one energy label
 MOVING_COST_FIXED = 2000       # Fixed cost of relocating
 MOVING_COST_VARIABLE = 0.02    # e.g., 2% of house value
+VALUE_PER_LABEL = 2000         # Market value gained per energy label
 
 # Weights for Satisfaction Equation (The alpha, beta, gamma from Eq 3.2)
 WEIGHT_FINANCIAL = 0.4
@@ -21,17 +40,43 @@ MAX_WEALTH = 500000
 MAX_QUALITY = 1.0
 MAX_SIZE = 200  # square meters
 
+# Reciprocals of the normalization ranges, folded once so the satisfaction
+# code multiplies instead of dividing
+_INV_W = 1.0 / (MAX_WEALTH - MIN_WEALTH)
+_INV_L = 1.0 / 7.0
+_INV_Q = 1.0 / MAX_QUALITY
+
+# Intention codes used in the model's per-agent arrays
+STAY, UPGRADE, BUY = 0, 1, 2
+INTENTIONS = ("STAY", "UPGRADE", "BUY")
+
 #%% --- HELPER FUNCTIONS ---
 
-def normalize(value, min_val, max_val):
+@njit(cache=True, fastmath=True)
+def _norm_financial(projected_savings):
+    """
+    Normalized (0-1) financial term of S for the given projected savings.
+    """
+    # Clamps written as conditional expressions rather than min()/max()
+    # calls so the JIT can lower them to branchless selects
+    norm_financial = (projected_savings - MIN_WEALTH) * _INV_W
+    norm_financial = 0.0 if norm_financial < 0.0 else norm_financial
+    return 1.0 if norm_financial > 1.0 else norm_financial
+
+@njit(cache=True, fastmath=True)
+def _satisfaction(savings, upgrade_cost, moving_cost, label, quality, bonus):
     """
-    Normalizes a value to 0-1 scale.
+    Compiled version of HomeOwner.calculate_satisfaction on plain numbers.
     """
-    if max_val == min_val:
-        return 0
-    # Clamp value to ensure it stays between 0-1
-    val = max(min_val, min(value, max_val))
-    return (val - min_val) / (max_val - min_val)
+    norm_financial = _norm_financial(savings - upgrade_cost - moving_cost)
+    projected_label = label + bonus
+    projected_label = projected_label if projected_label < 8 else 7
+    return (WEIGHT_FINANCIAL * norm_financial) + \
+           (WEIGHT_ENVIRONMENT * (projected_label * _INV_L)) + \
+           (WEIGHT_COMFORT * (quality * _INV_Q))
+
+# Warm up once at import so the first model step doesn't pay for compilation
+_satisfaction(0, 0, 0, 0, 0.0, 0)
 
 def calculate_mortgage_capacity(income):
     """
@@ -41,49 +86,267 @@ def calculate_mortgage_capacity(income):
 
 def compute_avg_label(model):
     """
-    DataCollector function to track average energy label.
-    Checks all HomeOwner agents and averages their house's energy label.
+    Model-level metric: average energy label (recorded every step).
+    Averages the energy label of every owned house.
+    """
+    owned_labels = model.house_labels[model.owned_mask]
+    if owned_labels.size == 0: return 0
+    return owned_labels.mean()
+
+@njit(cache=True, parallel=True)
+def _decide_kernel(savings, income, cur_label, cur_quality,
+                   order, cheapest_so_far, house_score,
+                   out_intention, out_target):
+    """
+    Compiled per-agent version of decide_all (see _decide_numpy), parallel
+    over agents.
+    The vacancy ranking (order, cheapest_so_far, house_score) is built once
+    by decide_all; results are written into out_intention / out_target.
     """
-    agent_labels = [a.house.energy_label for a in model.schedule.agents 
-                    if isinstance(a, HomeOwner)]
-    if not agent_labels: return 0
-    return sum(agent_labels) / len(agent_labels)
+    n_vacant = order.size
+    for i in prange(savings.size):
+        # --- A. STAY ---
+        S_current = _satisfaction(savings[i], 0, 0, cur_label[i], cur_quality[i], 0)
+        
+        # --- B. UPGRADE ---
+        S_upgrade = -999.0
+        if savings[i] > COST_PER_LABEL_UPGRADE and cur_label[i] < 7:
+            S_upgrade = _satisfaction(savings[i], COST_PER_LABEL_UPGRADE, 0,
+                                      cur_label[i], cur_quality[i], 1)
+        
+        # --- C. MOVE: first vacancy in score order within budget ---
+        budget = savings[i] + income[i] * 5
+        lo = 0
+        hi = n_vacant
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if cheapest_so_far[mid] <= budget:
+                hi = mid
+            else:
+                lo = mid + 1
+        S_move = -999.0
+        best = -1
+        if lo < n_vacant:
+            best = order[lo]
+            S_move = (WEIGHT_FINANCIAL * _norm_financial(savings[i] - MOVING_COST_FIXED)) + \
+                     house_score[best]
+        
+        # --- D. COMPARE ---
+        if S_move > S_upgrade and S_move > S_current:
+            out_intention[i] = BUY
+            out_target[i] = best
+        elif S_upgrade > S_current:
+            out_intention[i] = UPGRADE
+            out_target[i] = -1
+        else:
+            out_intention[i] = STAY
+            out_target[i] = -1
+
+def rank_vacancies(vac_value, vac_label, vac_quality):
+    """
+    Ranks vacant houses by the house-dependent part of S (best first).
+    Returns (order, cheapest_so_far, house_score): vacancy positions in rank
+    order, the running minimum price along that order, and each vacancy's
+    score. Only changes when the vacancy pool does, so HousingModel caches it.
+    """
+    house_score = (WEIGHT_ENVIRONMENT * (vac_label * _INV_L)) + \
+                  (WEIGHT_COMFORT * (vac_quality * _INV_Q))
+    # Stable sort: among equal scores the earlier vacancy comes first
+    order = np.argsort(-house_score, kind="stable")
+    cheapest_so_far = np.minimum.accumulate(vac_value[order])
+    return order, cheapest_so_far, house_score
+
+def decide_all(savings, income, cur_label, cur_quality, ranking):
+    """
+    Decision rule for a batch of HomeOwners.
+    Takes one array entry per agent (savings, income, current house label
+    and quality) and the vacancy ranking from rank_vacancies.
+    Returns (intention code per agent, position of the chosen vacancy or -1).
+    Runs the compiled _decide_kernel when numba is installed, otherwise
+    _decide_numpy. The two are cross-checked in "Hidde verification.ipynb".
+    """
+    if not HAVE_NUMBA:
+        return _decide_numpy(savings, income, cur_label, cur_quality, ranking)
+    order, cheapest_so_far, house_score = ranking
+    intention = np.empty(savings.size, dtype=np.int8)
+    target = np.empty(savings.size, dtype=np.int64)
+    _decide_kernel(savings, income, cur_label, cur_quality,
+                   order, cheapest_so_far, house_score,
+                   intention, target)
+    return intention, target
+
+def _decide_numpy(savings, income, cur_label, cur_quality, ranking):
+    """
+    Vectorized NumPy version of decide_all.
+    """
+    n_agents = savings.size
+    order, cheapest_so_far, house_score = ranking
+    budget = savings + calculate_mortgage_capacity(income)
+    
+    def norm_financial(projected_savings):
+        return np.clip((projected_savings - MIN_WEALTH) * _INV_W, 0, 1)
+    
+    # The financial term only depends on the agent and the (constant) cost
+    # of each option, so it is computed once per agent rather than per house
+    nf_stay = norm_financial(savings)
+    nf_upgrade = norm_financial(savings - COST_PER_LABEL_UPGRADE)
+    nf_move = norm_financial(savings - MOVING_COST_FIXED)
+    
+    # --- A. EVALUATE CURRENT SITUATION (STAY) ---
+    norm_quality = cur_quality * _INV_Q
+    S_current = (WEIGHT_FINANCIAL * nf_stay) + \
+                (WEIGHT_ENVIRONMENT * (cur_label * _INV_L)) + \
+                (WEIGHT_COMFORT * norm_quality)
+    
+    # --- B. EVALUATE UPGRADE (STAY + RENOVATE) ---
+    # Only where they can afford it AND the house isn't already maxed out (Label < 7)
+    can_upgrade = (savings > COST_PER_LABEL_UPGRADE) & (cur_label < 7)
+    S_upgrade = (WEIGHT_FINANCIAL * nf_upgrade) + \
+                (WEIGHT_ENVIRONMENT * (np.clip(cur_label + 1, 0, 7) * _INV_L)) + \
+                (WEIGHT_COMFORT * norm_quality)
+    S_upgrade = np.where(can_upgrade, S_upgrade, -999)
+    
+    # --- C. EVALUATE MARKET (MOVE) ---
+    # nf_move is the same for every house, so an agent's best move is the
+    # affordable vacancy with the highest house-dependent score. Walking the
+    # vacancies from best to worst score, that is the first affordable one,
+    # i.e. the first position where the running minimum price drops within
+    # budget. The search stops there instead of scoring every vacancy.
+    target = np.full(n_agents, -1, dtype=np.int64)
+    S_move = np.full(n_agents, -999.0)
+    first = np.searchsorted(-cheapest_so_far, -budget, side="left")
+    has_option = first < order.size
+    best = order[first[has_option]]
+    S_move[has_option] = (WEIGHT_FINANCIAL * nf_move[has_option]) + \
+                         house_score[best]
+    target[has_option] = best
+    
+    # --- D. COMPARE AND SET INTENTION ---
+    intention = np.where((S_move > S_upgrade) & (S_move > S_current), BUY,
+                         np.where(S_upgrade > S_current, UPGRADE, STAY)).astype(np.int8)
+    target[intention != BUY] = -1
+    return intention, target
+
+# Warm up once at import (compiles _decide_kernel for the model's dtypes)
+decide_all(np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64),
+           np.zeros(1, dtype=np.int8), np.zeros(1),
+           rank_vacancies(np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int8), np.zeros(1)))
 
     
 
 #%% Assets (house agent)
 class House(mesa.Agent):
-    def __init__(self, unique_id, model, energy_label, size, quality, price):
+    def __init__(self, unique_id, model, energy_label, size, quality, price, idx):
         super().__init__(unique_id, model)
+        # Label, quality, value and owner live in the model's house arrays at self.idx
+        self.idx = idx
         self.energy_label = energy_label  # Int 0-7 (G to A+++)
         self.size = size
         self.quality = quality
         self.market_value = price
         
         # Linkage
+        self._owner = None
         self.owner = None    # Will point to a HomeOwner object
         self.is_vacant = False 
+        self._vac_idx = -1   # Position in the model's vacancy arrays
+
+    @property
+    def energy_label(self):
+        return int(self.model.house_labels[self.idx])
+
+    @energy_label.setter
+    def energy_label(self, value):
+        self.model.house_labels[self.idx] = value
+        self.model._ranking = None
+
+    @property
+    def market_value(self):
+        return int(self.model.house_values[self.idx])
+
+    @market_value.setter
+    def market_value(self, value):
+        self.model.house_values[self.idx] = value
+        self.model._ranking = None
+
+    @property
+    def quality(self):
+        return float(self.model.house_quality[self.idx])
+
+    @quality.setter
+    def quality(self, value):
+        self.model.house_quality[self.idx] = value
+        self.model._ranking = None
+
+    @property
+    def owner(self):
+        return self._owner
+
+    @owner.setter
+    def owner(self, owner):
+        self._owner = owner
+        self.model.house_owner_idx[self.idx] = -1 if owner is None else owner.idx
 
     def update_energy_label(self, levels=1):
         """
         Increments label and updates market value.
         """
-        self.energy_label += levels
-        # Assuming value increases with energy label
-        self.market_value += (levels * 2000)
+        self.model.upgrade_houses(self.idx, levels)
 
 #%% The decision maker (HomeOwner agent)
 
 class HomeOwner(mesa.Agent):
-    def __init__(self, unique_id, model, income, savings, house):
+    def __init__(self, unique_id, model, income, savings, house, idx):
         super().__init__(unique_id, model)
+        # Money, house and decision live in the model's owner arrays at self.idx
+        self.idx = idx   # Position in model.homeowners
         self.income = income
         self.savings = savings
+        self._house = None
         self.house = house
         
         # Decision Variables
         self.intention = "STAY" 
-        self.target_house_id = None
+
+    @property
+    def income(self):
+        return int(self.model.owner_income[self.idx])
+
+    @income.setter
+    def income(self, value):
+        self.model.owner_income[self.idx] = value
+
+    @property
+    def savings(self):
+        return int(self.model.owner_savings[self.idx])
+
+    @savings.setter
+    def savings(self, value):
+        self.model.owner_savings[self.idx] = value
+
+    @property
+    def house(self):
+        return self._house
+
+    @house.setter
+    def house(self, house):
+        self._house = house
+        self.model.owner_house[self.idx] = house.idx
+
+    @property
+    def intention(self):
+        return INTENTIONS[self.model.intentions[self.idx]]
+
+    @intention.setter
+    def intention(self, value):
+        self.model.intentions[self.idx] = INTENTIONS.index(value)
+        if value != "BUY":
+            self.model.targets[self.idx] = -1
+
+    @property
+    def target_house_id(self):
+        target = self.model.targets[self.idx]
+        return None if target < 0 else self.model.houses[target].unique_id
 
     # ADDED: bonus_energy parameter
     def calculate_satisfaction(self, target_house, upgrade_cost=0, moving_cost=0, bonus_energy=0):
@@ -91,131 +354,188 @@ class HomeOwner(mesa.Agent):
         Calculates Utility (S). 
         bonus_energy: Int used to simulate an upgrade (e.g. +1 label)
         """
-        # 1. Projected Wealth
-        projected_savings = self.savings - upgrade_cost - moving_cost
-        norm_financial = normalize(projected_savings, MIN_WEALTH, MAX_WEALTH)
-        
-        # 2. House Attributes (WITH BONUS ADDED)
-        # We clamp the value to max 7 using min(..., 7)
-        projected_label = min(target_house.energy_label + bonus_energy, 7)
-        
-        norm_energy = normalize(projected_label, 0, 7)
-        norm_quality = normalize(target_house.quality, 0, MAX_QUALITY)
-        
-        # 3. Weighted Sum
-        S = (WEIGHT_FINANCIAL * norm_financial) + \
-            (WEIGHT_ENVIRONMENT * norm_energy) + \
-            (WEIGHT_COMFORT * norm_quality)
-        
-        return S
+        return _satisfaction(self.savings, upgrade_cost, moving_cost,
+                             target_house.energy_label, target_house.quality,
+                             bonus_energy)
 
     def step(self):
-        # --- A. EVALUATE CURRENT SITUATION (STAY) ---
-        S_current = self.calculate_satisfaction(self.house)
-        
-        # --- B. EVALUATE UPGRADE (STAY + RENOVATE) ---
-        S_upgrade = -999 # Default low value
-        
-        # Only check if they can afford it AND the house isn't already maxed out (Label < 7)
-        if self.savings > COST_PER_LABEL_UPGRADE and self.house.energy_label < 7:
-            # FIX: We pass bonus_energy=1 to simulate the benefit
-            S_upgrade = self.calculate_satisfaction(self.house, 
-                                                  upgrade_cost=COST_PER_LABEL_UPGRADE,
-                                                  bonus_energy=1)
-        
-        # --- C. EVALUATE MARKET (MOVE) ---
-        best_market_house = None
-        S_move = -999
-        
-        for house in self.model.vacancy_pool:
-            if house.market_value <= (self.savings + calculate_mortgage_capacity(self.income)):
-                 s_temp = self.calculate_satisfaction(house, moving_cost=MOVING_COST_FIXED)
-                 if s_temp > S_move:
-                     S_move = s_temp
-                     best_market_house = house
-        
-        # --- D. COMPARE AND SET INTENTION ---
-        if S_move > S_upgrade and S_move > S_current:
-            self.intention = "BUY"
-            self.target_house_id = best_market_house.unique_id
-        elif S_upgrade > S_current:
-            self.intention = "UPGRADE"
-            self.target_house_id = None
-        else:
-            self.intention = "STAY"
-            self.target_house_id = None
+        """
+        Decides this agent alone. HousingModel.step decides all agents at
+        once with the same rule (see decide_all).
+        """
+        self.model.decide([self.idx])
             
-        # Optional: Print intention for debugging
-        # print(f"{self.unique_id}: {self.intention} (Stay={S_current:.2f}, Upg={S_upgrade:.2f}, Move={S_move:.2f})")
+        if VERBOSE:
+            print(f"{self.unique_id}: {self.intention} -> {self.target_house_id}")
 
 #%% Market manager
 
 class HousingModel(mesa.Model):
-    def __init__(self, n_agents=10, n_houses=15):
+    def __init__(self, n_agents=10, n_houses=15, seed=None, n_steps=100):
         super().__init__()
-        # FIX: Removed "advance" from stage_list to avoid errors
-        self.schedule = mesa.time.StagedActivation(self, stage_list=["step"]) 
-        self.vacancy_pool = []
-        self.datacollector = mesa.DataCollector(
-            model_reporters={"Avg_Label": compute_avg_label}
-        )
+        self.vacancy_pool = {}  # unique_id -> House
+        
+        # Vacancy pool as an array of House.idx. Only the first n_vacant
+        # entries are valid; see add_vacancy / remove_vacancy. Value, label
+        # and quality are read from the house arrays, never copied.
+        self.n_vacant = 0
+        self.vac_house = np.empty(n_houses, dtype=np.int64)
+        self._ranking = None   # rank_vacancies() result, reset on any change
+        
+        # Per-step metric history, preallocated for n_steps (grown if a run
+        # goes longer) and only turned into a DataFrame on request
+        self.avg_label_history = np.empty(n_steps, dtype=np.float32)
+        self._t = 0
         
         # FIX: Create a dictionary to look up houses by ID later
         self.house_map = {} 
+        
+        # HomeOwner agents in activation order (there is no Mesa scheduler;
+        # step() decides all of them at once)
+        self.homeowners = []
+        self.houses = []
+        
+        # Struct-of-arrays house state, indexed by House.idx
+        self.house_labels = np.zeros(n_houses, dtype=np.int8)
+        self.house_values = np.zeros(n_houses, dtype=np.int64)
+        self.house_quality = np.zeros(n_houses, dtype=float)
+        self.house_owner_idx = np.full(n_houses, -1, dtype=np.int64)  # -1 = no owner
+        
+        # Struct-of-arrays owner state and decisions, indexed by HomeOwner.idx
+        self.owner_income = np.zeros(n_agents, dtype=np.int64)
+        self.owner_savings = np.zeros(n_agents, dtype=np.int64)
+        self.owner_house = np.zeros(n_agents, dtype=np.int64)        # House.idx
+        self.bid_capacity = np.zeros(n_agents, dtype=np.int64)       # Savings + Max Mortgage
+        self.intentions = np.full(n_agents, STAY, dtype=np.int8)
+        self.targets = np.full(n_agents, -1, dtype=np.int64)         # House.idx, -1 = none
+
+        # Draw all random attributes up front, one array per attribute
+        # (upper bounds are exclusive, so these match randint(0, 5) etc.)
+        rng = np.random.default_rng(seed)
+        labels = rng.integers(0, 6, n_houses)
+        sizes = rng.integers(50, 151, n_houses)
+        qualities = rng.random(n_houses)
+        prices = rng.integers(100000, 300001, n_houses)
+        incomes = rng.integers(30000, 80001, n_agents)
+        savings = rng.integers(5000, 50001, n_agents)
 
         # 1. Create HOUSES
-        all_houses = []
-        for i in range(n_houses):
+        for i, (label, size, quality, price) in enumerate(zip(labels, sizes, qualities, prices)):
             h = House(unique_id=f"H_{i}", 
                       model=self, 
-                      energy_label=random.randint(0, 5), 
-                      size=random.randint(50, 150), 
-                      quality=random.random(), 
-                      price=random.randint(100000, 300000))
-            all_houses.append(h)
+                      energy_label=label, 
+                      size=size, 
+                      quality=quality, 
+                      price=price,
+                      idx=i)
+            self.houses.append(h)
             self.house_map[h.unique_id] = h # Store in map
         
         # 2. Create OWNERS
-        for i in range(n_agents):
-            house = all_houses[i]
+        for i, (income, saving) in enumerate(zip(incomes, savings)):
+            house = self.houses[i]
             owner = HomeOwner(unique_id=f"Owner_{i}", 
                               model=self, 
-                              income=random.randint(30000, 80000), 
-                              savings=random.randint(5000, 50000), 
-                              house=house)
+                              income=income, 
+                              savings=saving, 
+                              house=house,
+                              idx=i)
             house.owner = owner
-            self.schedule.add(owner)
+            self.homeowners.append(owner)
         
         # 3. Handle Remaining Houses
         for i in range(n_agents, n_houses):
-            vacant_house = all_houses[i]
+            vacant_house = self.houses[i]
             vacant_house.is_vacant = True
-            self.vacancy_pool.append(vacant_house)
+            self.add_vacancy(vacant_house)
             
-        print(f"Model Initialized: {n_agents} Agents, {len(self.vacancy_pool)} Vacant Houses")
+        if VERBOSE:
+            print(f"Model Initialized: {n_agents} Agents, {len(self.vacancy_pool)} Vacant Houses")
 
-    def resolve_market_conflicts(self):
-        # 1. Collect all bids FIRST
-        bids = {}
-        for agent in self.schedule.agents:
-            if isinstance(agent, HomeOwner) and agent.intention == "BUY":
-                target = agent.target_house_id
-                if target not in bids:
-                    bids[target] = []
-                bids[target].append(agent)
+    @property
+    def owned_mask(self):
+        """
+        Boolean mask over the house arrays selecting houses with an owner.
+        """
+        return self.house_owner_idx >= 0
+
+    def add_vacancy(self, house):
+        """
+        Puts a house in the vacancy pool and appends it to vac_house so that
+        decide() can score all vacant houses in one pass.
+        """
+        i = self.n_vacant
+        self.vacancy_pool[house.unique_id] = house
+        self.vac_house[i] = house.idx
+        house._vac_idx = i
+        self.n_vacant += 1
+        self._ranking = None
+
+    def remove_vacancy(self, house):
+        """
+        Takes a house out of the vacancy pool in O(1): the last entry of the
+        vac_house is swapped into its slot.
+        """
+        del self.vacancy_pool[house.unique_id]
+        i = house._vac_idx
+        last = self.n_vacant - 1
+        if i != last:
+            self.vac_house[i] = self.vac_house[last]
+            self.houses[self.vac_house[i]]._vac_idx = i
+        house._vac_idx = -1
+        self.n_vacant = last
+        self._ranking = None
+
+    def decide(self, owners=slice(None)):
+        """
+        Sets the intention and target house of the given HomeOwners
+        (indices into self.homeowners, default all) in one vectorized pass
+        over the owner and vacancy arrays.
+        The vacancy ranking is built once and reused until the pool or any
+        house changes, so deciding agents one at a time (HomeOwner.step)
+        within a step only costs a binary search each.
+        """
+        if self._ranking is None:
+            vacant = self.vac_house[:self.n_vacant]
+            self._ranking = rank_vacancies(self.house_values[vacant],
+                                           self.house_labels[vacant],
+                                           self.house_quality[vacant])
+        savings = self.owner_savings[owners]
+        income = self.owner_income[owners]
+        house = self.owner_house[owners]
         
-        # Debug Print
-        if len(bids) > 0:
-            print(f"MARKET: {len(bids)} houses have bids.")
+        intention, target = decide_all(savings, income,
+                                       self.house_labels[house],
+                                       self.house_quality[house],
+                                       self._ranking)
+        
+        self.bid_capacity[owners] = savings + calculate_mortgage_capacity(income)
+        self.intentions[owners] = intention
+        self.targets[owners] = np.where(target >= 0, self.vac_house[target], -1)
+
+    def resolve_market_conflicts(self):
+        # 1. Collect all bids FIRST (as arrays: bidder index, target, capacity)
+        bidders = np.flatnonzero(self.intentions == BUY)
+        targets = self.targets[bidders]
+        capacity = self.bid_capacity[bidders]
 
         # 2. Resolve Bids
-        for house_id, potential_buyers in bids.items():
-            # Sort by Financial Capacity (Savings + Max Mortgage)
-            winner = sorted(potential_buyers, 
-                          key=lambda x: x.savings + calculate_mortgage_capacity(x.income), 
-                          reverse=True)[0]
-            
-            print(f"MARKET: House {house_id} sold to {winner.unique_id}")
+        # Group bids by house, highest Financial Capacity first; the sort is
+        # stable so ties go to the earliest bidder. The first bid of each
+        # group is the winner.
+        order = np.lexsort((-capacity, targets))
+        sold, first = np.unique(targets[order], return_index=True)
+        winners = bidders[order[first]]
+        
+        # Debug Print
+        if VERBOSE and sold.size > 0:
+            print(f"MARKET: {sold.size} houses have bids.")
+        
+        for house_idx, winner_idx in zip(sold, winners):
+            house_id = self.houses[house_idx].unique_id
+            winner = self.homeowners[winner_idx]
+            if VERBOSE:
+                print(f"MARKET: House {house_id} sold to {winner.unique_id}")
             self.execute_move(winner, house_id)
 
     def execute_move(self, buyer, house_id):
@@ -223,46 +543,110 @@ class HousingModel(mesa.Model):
         old_house = buyer.house
         old_house.owner = None
         old_house.is_vacant = True
-        self.vacancy_pool.append(old_house)
+        self.add_vacancy(old_house)
         
         # 2. Buyer gets new house (Using the FIX: self.house_map)
         new_house = self.house_map[house_id] 
         new_house.owner = buyer
         new_house.is_vacant = False
         
-        if new_house in self.vacancy_pool:
-            self.vacancy_pool.remove(new_house)
+        if house_id in self.vacancy_pool:
+            self.remove_vacancy(new_house)
             
         # 3. Update Buyer
         buyer.savings -= MOVING_COST_FIXED
         buyer.house = new_house
 
+    def upgrade_houses(self, houses, levels=1):
+        """
+        Raises the energy label of the given houses (House.idx, one or many)
+        and updates their market value.
+        """
+        self.house_labels[houses] += levels
+        # Assuming value increases with energy label
+        self.house_values[houses] += (levels * VALUE_PER_LABEL)
+        self._ranking = None
+
     def step(self):
-        self.schedule.step()
-        self.resolve_market_conflicts()
+        self.decide()
         
-        # Handle Upgrades
-        for agent in self.schedule.agents:
-            if isinstance(agent, HomeOwner) and agent.intention == "UPGRADE":
-                agent.house.update_energy_label()
-                agent.savings -= COST_PER_LABEL_UPGRADE
-                agent.intention = "STAY"
+        # Handle Upgrades: applied to all upgraders at once.
+        # Upgraders don't bid, so this is independent of the market below.
+        upgraders = np.flatnonzero(self.intentions == UPGRADE)
+        self.upgrade_houses(self.owner_house[upgraders])
+        self.owner_savings[upgraders] -= COST_PER_LABEL_UPGRADE
+        self.intentions[upgraders] = STAY
         
-        self.datacollector.collect(self)
+        self.resolve_market_conflicts()
+        self.collect()
+
+    def collect(self):
+        """
+        Records this step's metrics into the preallocated history arrays.
+        """
+        if self._t == self.avg_label_history.size:
+            self.avg_label_history = np.resize(self.avg_label_history, 2 * self._t + 1)
+        self.avg_label_history[self._t] = compute_avg_label(self)
+        self._t += 1
+
+    def get_model_vars_dataframe(self):
+        """
+        Metric history as a DataFrame, one row per step (same layout as
+        mesa.DataCollector.get_model_vars_dataframe).
+        """
+        return pd.DataFrame({"Avg_Label": self.avg_label_history[:self._t]})
+
+#%% --- REPLICATES ---
+
+def run_once(seed, n_agents, n_houses, n_steps):
+    """
+    Runs one independent simulation and returns its metrics frame.
+    Module-level so multiprocessing can send it to worker processes.
+    """
+    model = HousingModel(n_agents=n_agents, n_houses=n_houses, seed=seed, n_steps=n_steps)
+    for _ in range(n_steps):
+        model.step()
+    return model.get_model_vars_dataframe()
+
+def run_replicates(seeds, n_agents, n_houses, n_steps, processes=None):
+    """
+    Runs one simulation per seed in parallel and returns a single frame
+    with a "Seed" column identifying each run.
+    Workers are started with "spawn" on every platform and import run_once
+    from this file, so call it from `python try2.py` or after
+    `from try2 import run_replicates`, not from cells run in an
+    interactive window (workers can't find functions defined there).
+    """
+    seeds = list(seeds)
+    # "spawn" rather than the platform default: forking after numba's
+    # parallel kernel has started its worker threads (TBB) is not safe and
+    # leaves the parent hanging at exit
+    with mp.get_context("spawn").Pool(processes) as pool:
+        results = pool.starmap(run_once, [(seed, n_agents, n_houses, n_steps) for seed in seeds])
+    return pd.concat(results, keys=seeds, names=["Seed", "Step"]).reset_index()
 
 #%% --- RUN TEST SIMULATION ---
-# 1. Setup
-print("--- STARTING SIMULATION ---")
-model = HousingModel(n_agents=5, n_houses=8)
-
-# 2. Run for 3 steps
-for i in range(3):
-    print(f"\n--- STEP {i+1} ---")
-    model.step()
-
-# 3. Check Results
-print("\n--- FINAL RESULTS ---")
-print(f"Average Energy Label: {compute_avg_label(model):.2f}")
-for agent in model.schedule.agents:
-    if isinstance(agent, HomeOwner):
-        print(f"Agent {agent.unique_id} is in House {agent.house.unique_id} (Label: {agent.house.energy_label})")
\ No newline at end of file
+# Set to True to also run the parallel replicates demo (starts a process pool)
+RUN_REPLICATES = False
+
+if __name__ == "__main__":
+    # 1. Setup
+    print("--- STARTING SIMULATION ---")
+    model = HousingModel(n_agents=5, n_houses=8)
+
+    # 2. Run for 3 steps
+    for i in range(3):
+        print(f"\n--- STEP {i+1} ---")
+        model.step()
+
+    # 3. Check Results
+    print("\n--- FINAL RESULTS ---")
+    print(f"Average Energy Label: {compute_avg_label(model):.2f}")
+    for agent in model.homeowners:
+        print(f"Agent {agent.unique_id} is in House {agent.house.unique_id} (Label: {agent.house.energy_label})")
+
+    # 4. Independent replicates, one process per run (optional)
+    if RUN_REPLICATES:
+        print("\n--- REPLICATES ---")
+        replicates = run_replicates(seeds=range(8), n_agents=5, n_houses=8, n_steps=3)
+        print(replicates.groupby("Step")["Avg_Label"].describe())